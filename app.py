@@ -1,11 +1,20 @@
 import streamlit as st
 import pandas as pd
-from pypdf import PdfReader, PdfWriter, PageObject
-from reportlab.pdfgen import canvas
+from pypdf import PdfReader
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
-import io, re, zipfile, os, datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import io, zipfile, os, datetime, itertools, tempfile
 from supabase import create_client, Client
+from certificate_renderer import worker_pool, render_in_order, hex_to_rgb
+
+# polars parses CSV/Excel with multithreaded native readers; fall back to
+# pandas' readers when it isn't installed.
+try:
+    import polars as pl
+except ImportError:
+    pl = None
 
 # --- FONT SETUP ---
 # NOTE: Ensure 'Bliss Extra Bold.ttf' is in the root directory for deployment.
@@ -19,7 +28,13 @@ except Exception as e:
 # Requires Streamlit secrets: st.secrets["supabase"]["url"] and st.secrets["supabase"]["key"]
 SUPABASE_URL = st.secrets["supabase"]["url"]
 SUPABASE_KEY = st.secrets["supabase"]["key"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+@st.cache_resource
+def get_supabase_client() -> Client:
+    """Create the Supabase client once per server process instead of on every rerun."""
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+supabase: Client = get_supabase_client()
 
 def init_db():
     pass 
@@ -45,11 +60,30 @@ if not os.path.exists(template_path):
     st.error("Certificate template not found. Please ensure 'certificate_template.pdf' is in the working directory.")
     st.stop()
 
+@st.cache_resource
+def load_template():
+    """Read and measure the template once per server process, not on every rerun."""
+    with open(template_path, 'rb') as f:
+        template_bytes = f.read()
+    media_box = PdfReader(io.BytesIO(template_bytes)).pages[0].mediabox
+    return template_bytes, float(media_box.width), float(media_box.height)
+
+template_bytes, w, h = load_template()
+
 # --- UTILITY FUNCTION ---
-def hex_to_rgb(hex_color):
-    """Convert hex color to RGB tuple (0-1 range for ReportLab)."""
-    hex_color = hex_color.lstrip('#')
-    return tuple(int(hex_color[i:i+2], 16) / 255 for i in (0, 2, 4))
+def read_participants(uploaded_file, polars_reader, pandas_reader):
+    """Read the participant list with polars if possible, otherwise pandas.
+
+    polars also needs pyarrow (for to_pandas) and fastexcel (for Excel), and
+    rejects some files pandas accepts (e.g. ragged CSV rows), so any polars
+    failure falls back to the pandas reader.
+    """
+    if pl is not None:
+        try:
+            return polars_reader(uploaded_file).to_pandas()
+        except Exception:
+            uploaded_file.seek(0)
+    return pandas_reader(uploaded_file)
 
 # --- CERTIFICATE STYLES (HARDCODED) ---
 student_font_size = 18
@@ -64,6 +98,30 @@ school_y = 550
 school_font = "Helvetica-Bold"
 school_color = "#000000"
 
+# Colors are constant, so convert them once rather than for every row
+student_rgb = hex_to_rgb(student_color)
+school_rgb = hex_to_rgb(school_color)
+
+# Handed to each worker process once (see certificate_renderer.init_worker)
+style_tuple = (
+    student_font, student_font_size, student_x, student_y, student_rgb,
+    school_font, school_font_size, school_x, school_y, school_rgb
+)
+
+# Rows per worker task; each batch shares one ReportLab overlay document
+batch_size = 16
+
+# Finished batches wait in memory until they're written to the zip, so cap how
+# many may be rendering or waiting at once (about max_pending_batches *
+# batch_size PDFs)
+max_workers = os.cpu_count() or 1
+max_pending_batches = 2 * max_workers
+
+# PDFs are already Flate-compressed, so deflating them again costs CPU for almost
+# no size reduction. Set to False to deflate the zip anyway.
+fast_zip = True
+zip_compression = zipfile.ZIP_STORED if fast_zip else zipfile.ZIP_DEFLATED
+
 # --- USER INPUT FIELDS INSIDE A FORM ---
 st.markdown("---")
 st.markdown("1. Submit Your Details to Download Certificates")
@@ -146,9 +204,19 @@ if st.session_state.details_submitted:
             file_name = excel_file.name.lower()
             
             if file_name.endswith('.csv'):
-                participants = pd.read_csv(excel_file, header=0)
+                participants = read_participants(
+                    excel_file,
+                    # polars keeps blank lines as all-null rows; pandas skips them
+                    lambda f: pl.read_csv(f, infer_schema_length=0)
+                        .filter(~pl.all_horizontal(pl.all().is_null())),
+                    lambda f: pd.read_csv(f, header=0),
+                )
             elif file_name.endswith(('.xlsx', '.xls')):
-                participants = pd.read_excel(excel_file, header=0)
+                participants = read_participants(
+                    excel_file,
+                    lambda f: pl.read_excel(f),
+                    lambda f: pd.read_excel(f, header=0),
+                )
             else:
                 st.error("Unsupported file format detected. Please upload an XLSX or CSV file.")
                 st.stop()
@@ -161,7 +229,7 @@ if st.session_state.details_submitted:
         
         # Handle auto-generated column names if the first cell is empty
         if participants.columns[0] == "" or participants.columns[0] is None:
-            participants.columns = ["Student Name"]
+            participants = participants.rename(columns={participants.columns[0]: "Student Name"})
 
         # Auto-detect columns
         student_col = next(
@@ -184,92 +252,92 @@ if st.session_state.details_submitted:
                 st.caption("Initiating PDF merging and compression...")
             
             # --- CERTIFICATE GENERATION ---
-            zip_buf = io.BytesIO()
             success, fail = 0, 0
 
-            with zipfile.ZipFile(zip_buf, "w", zipfile.ZIP_DEFLATED) as zipf:
-                status_placeholder = st.empty() 
-                
-                for idx, row in participants.iterrows():
-                    status_placeholder.info(f"Processing certificate {idx + 1} of {len(participants)} for: {row[student_col]}...")
-                    
+            # Clean and validate the columns up front (vectorized)
+            students = participants[student_col].astype("string").str.strip()
+            if school_col is not None:
+                schools = participants[school_col].astype("string").str.strip().fillna("")
+            else:
+                schools = pd.Series("", index=participants.index, dtype="string")
+
+            cleaned = pd.DataFrame({"student": students, "school": schools})
+            cleaned = cleaned[students.fillna("") != ""]
+            fail += len(participants) - len(cleaned)
+
+            # Convert column-wise to plain Python lists (one C-level pass per
+            # column) so workers only ever unpickle tiny (idx, str, str) tuples
+            rows = list(zip(
+                cleaned.index.tolist(),
+                cleaned["student"].tolist(),
+                cleaned["school"].tolist(),
+            ))
+
+            batches = (rows[i:i + batch_size] for i in range(0, len(rows), batch_size))
+
+            # Spool the archive to a temp file instead of growing it in memory
+            zip_tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
+            try:
+                # Render in parallel; ZipFile isn't thread-safe, so only this
+                # process writes to it.
+                with zipfile.ZipFile(zip_tmp, "w", zip_compression) as zipf:
+                    executor = worker_pool(template_bytes, w, h, style_tuple, max_workers=max_workers)
                     try:
-                        raw_student = row[student_col]
-                        if pd.isna(raw_student) or str(raw_student).strip() == "":
-                            fail += 1
-                            continue
-                        student = str(raw_student).strip()
-
-                        school = ""
-                        if school_col is not None:
-                            raw_school = row[school_col]
-                            if not pd.isna(raw_school) and str(raw_school).strip() != "":
-                                school = str(raw_school).strip()
-
-                        # PDF Processing
-                        base_reader = PdfReader(template_path)
-                        base_page = base_reader.pages[0]
-                        media_box = base_page.mediabox
-                        w = float(media_box.width)
-                        h = float(media_box.height)
-
-                        # Create overlay canvas
-                        overlay_packet = io.BytesIO()
-                        c = canvas.Canvas(overlay_packet, pagesize=(w, h))
-                        
-                        # Draw Student Name
-                        c.setFillColorRGB(*hex_to_rgb(student_color))  
-                        c.setFont(student_font, student_font_size)     
-                        c.drawCentredString(student_x, student_y, student)
-
-                        # Draw School Name
-                        if school:
-                            c.setFillColorRGB(*hex_to_rgb(school_color))  
-                            c.setFont(school_font, school_font_size)      
-                            c.drawCentredString(school_x, school_y, school)
-
-                        c.save()
-                        overlay_packet.seek(0)
-
-                        # Merge PDF pages
-                        overlay_reader = PdfReader(overlay_packet)
-                        merged_page = PageObject.create_blank_page(width=w, height=h)
-                        merged_page.merge_page(base_page)
-                        merged_page.merge_page(overlay_reader.pages[0])
-
-                        # Write output PDF
-                        out_buf = io.BytesIO()
-                        writer = PdfWriter()
-                        writer.add_page(merged_page)
-                        writer.write(out_buf)
-                        out_buf.seek(0)
-
-                        # Safe filename and add to ZIP
-                        safe_name = re.sub(r'[<>:"/\\|?*]', "_", student.replace(" ", "_"))
-                        filename = f"{idx+1:03d}_{safe_name}_certificate.pdf"
-
-                        zipf.writestr(filename, out_buf.getvalue())
-                        success += 1
-
-                    except Exception as e:
-                        fail += 1
-                        status_placeholder.warning(f"Error creating certificate for {student or 'Unknown'} (Row {idx+1}): {e}")
-
-            # Finalize and download
-            status_placeholder.empty() 
-            zip_buf.seek(0)
+                        status_placeholder = st.empty() 
+
+                        # Each UI update is a websocket message, so only refresh
+                        # the progress bar about every 1% of rows.
+                        progress = st.progress(0.0, text="Generating certificates...")
+                        progress_step = max(1, len(rows) // 100)
+
+                        processed = 0
+                        try:
+                            results = itertools.chain.from_iterable(render_in_order(executor, batches, max_pending_batches))
+                            for done, ((idx, student, school), (filename, pdf_bytes, error)) in enumerate(zip(rows, results)):
+                                processed = done + 1
+                                if done % progress_step == 0:
+                                    progress.progress(done / len(rows), text=f"Processing certificate {done + 1} of {len(rows)}...")
+
+                                if error is not None:
+                                    fail += 1
+                                    status_placeholder.warning(f"Error creating certificate for {student or 'Unknown'} (Row {idx+1}): {error}")
+                                    continue
+
+                                zipf.writestr(filename, pdf_bytes)
+                                success += 1
+                        except BrokenProcessPool:
+                            # A worker died (e.g. out of memory); count every row
+                            # that never came back as a failure.
+                            fail += len(rows) - processed
+                            st.error(f"Certificate generation stopped unexpectedly; {len(rows) - processed} certificate(s) were not created.")
+
+                        progress.progress(1.0, text="All certificates processed.")
+                    finally:
+                        # If Streamlit stops or reruns the script mid-run, drop
+                        # the queued batches instead of waiting for them all
+                        executor.shutdown(cancel_futures=True)
+
+                # Finalize and download
+                status_placeholder.empty() 
+                zip_tmp.close()
             
-            # --- FINAL SUCCESS MESSAGE AND DOWNLOAD BUTTON ---
-            st.balloons()
-            st.success(f"Generation Completed! {success} successful, {fail} failed.")
-
-            st.download_button(
-                "Download All Certificates (.zip)",
-                data=zip_buf.getvalue(),
-                file_name="certificates.zip",
-                mime="application/zip"
-            )
-            # --- END FINAL ---
+                # --- FINAL SUCCESS MESSAGE AND DOWNLOAD BUTTON ---
+                st.balloons()
+                st.success(f"Generation Completed! {success} successful, {fail} failed.")
+
+                # Streamlit reads the whole file into its media store to serve
+                # the button, so the finished archive is held in memory once here
+                with open(zip_tmp.name, "rb") as zip_file:
+                    st.download_button(
+                        "Download All Certificates (.zip)",
+                        data=zip_file,
+                        file_name="certificates.zip",
+                        mime="application/zip"
+                    )
+                # --- END FINAL ---
+            finally:
+                zip_tmp.close()
+                os.remove(zip_tmp.name)
     else:
         # Message if details are submitted but file is missing
         st.info("Please upload the Participant List (Excel/CSV) to proceed with generation.")
@@ -0,0 +1,211 @@
+from pypdf import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.context import SpawnContext, SpawnProcess
+import io, sys, threading
+
+# pikepdf (QPDF bindings) does the page merge in native code; fall back to
+# pypdf's pure-Python merge when it isn't installed.
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+# --- FONT SETUP ---
+# Worker processes don't run app.py, so register the custom font here as well.
+# app.py already warns the user if the font is missing.
+try:
+    pdfmetrics.registerFont(TTFont('BlissExtraBold', './Bliss Extra Bold.ttf'))
+except Exception:
+    pass
+
+# Maps spaces and characters that aren't allowed in file names on common
+# filesystems to underscores, in a single str.translate pass
+_SAFE_FILENAME_TABLE = str.maketrans({c: "_" for c in ' <>:"/\\|?*'})
+
+# --- WORKER STATE ---
+# Certificates are rendered in worker processes, so everything a worker needs
+# lives in this importable module instead of app.py (which runs Streamlit code
+# on import). init_worker() fills these in once per process so batches only
+# carry their rows.
+_template_pdf = None  # keeps the template document open while its page is used
+_template = None      # the template's first page
+_page_size = None
+_style = None
+
+
+# --- WORKER POOL ---
+# Serializes hiding __main__.__file__ between concurrent sessions' pools
+_main_file_lock = threading.Lock()
+
+
+class _WorkerProcess(SpawnProcess):
+    """Spawned worker that doesn't re-run the script that started it.
+
+    spawn rebuilds the parent's __main__ in each child by re-importing
+    __main__.__file__, and Streamlit points that at app.py, so every worker
+    would re-run the whole app (secrets, Supabase client, form) in bare mode.
+    Workers only need this module, so the path is hidden while they launch.
+    """
+
+    def start(self):
+        main = sys.modules["__main__"]
+        with _main_file_lock:
+            main_file = main.__dict__.pop("__file__", None)
+            try:
+                super().start()
+            finally:
+                if main_file is not None:
+                    main.__file__ = main_file
+
+
+class _WorkerContext(SpawnContext):
+    Process = _WorkerProcess
+
+
+def worker_pool(template_bytes, w, h, style, max_workers=None):
+    """Create a ProcessPoolExecutor whose workers are set up by init_worker().
+
+    Workers are spawned rather than forked: forking Streamlit's threaded
+    server can copy a lock held by another thread into the child, which then
+    deadlocks on it.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=_WorkerContext(),
+        initializer=init_worker,
+        initargs=(template_bytes, w, h, style),
+    )
+
+
+def render_in_order(executor, batches, max_pending):
+    """Like executor.map(render_batch, batches), with a bounded backlog.
+
+    executor.map() submits every batch up front and the pool keeps collecting
+    finished ones however slowly they're consumed. Here at most max_pending
+    batches are submitted and not yet yielded; the next one is submitted as
+    the oldest is handed back, so results are yielded in order.
+    """
+    pending = deque()
+    for batch in batches:
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+        pending.append(executor.submit(render_batch, batch))
+    while pending:
+        yield pending.popleft().result()
+
+
+# --- UTILITY FUNCTIONS ---
+def hex_to_rgb(hex_color):
+    """Convert hex color to RGB tuple (0-1 range for ReportLab)."""
+    # bytes.fromhex parses all three channels in one C call
+    r, g, b = bytes.fromhex(hex_color.lstrip('#'))[:3]
+    return (r / 255, g / 255, b / 255)
+
+
+def init_worker(template_bytes, w, h, style):
+    """ProcessPoolExecutor initializer: parse the template once per worker."""
+    global _template_pdf, _template, _page_size, _style
+    if pikepdf is not None:
+        _template_pdf = pikepdf.open(io.BytesIO(template_bytes))
+    else:
+        _template_pdf = PdfReader(io.BytesIO(template_bytes))
+    _template = _template_pdf.pages[0]
+    _page_size = (w, h)
+    _style = style
+
+
+def _merge_pikepdf(base_page, overlay_page):
+    """Stamp the overlay onto a copy of the template page using pikepdf."""
+    out = pikepdf.Pdf.new()
+    out.pages.append(base_page)
+    out.pages[0].add_overlay(overlay_page)
+
+    out_buf = io.BytesIO()
+    out.save(out_buf, linearize=False, compress_streams=True)
+    return out_buf.getvalue()
+
+
+def _merge_pypdf(base_page, overlay_page):
+    """Stamp the overlay onto a copy of the template page using pypdf."""
+    writer = PdfWriter()
+    page = writer.add_page(base_page)
+    page.merge_page(overlay_page)
+
+    out_buf = io.BytesIO()
+    writer.write(out_buf)
+    return out_buf.getvalue()
+
+
+def _certificate_filename(idx, student):
+    """Build the zip entry name for a participant row."""
+    safe_name = student.translate(_SAFE_FILENAME_TABLE)
+    return f"{idx+1:03d}_{safe_name}_certificate.pdf"
+
+
+# --- CERTIFICATE RENDERING ---
+def render_batch(rows):
+    """Render a batch of certificates in a worker set up by init_worker().
+
+    Takes a list of (idx, student, school) tuples and returns a list of
+    (filename, pdf_bytes, error) in the same order. Errors are returned rather
+    than raised so a bad batch doesn't abort the whole run.
+    """
+    w, h = _page_size
+    (student_font, student_font_size, student_x, student_y, student_rgb,
+     school_font, school_font_size, school_x, school_y, school_rgb) = _style
+    template = _template
+
+    filenames = [_certificate_filename(idx, student) for idx, student, school in rows]
+
+    try:
+        # One canvas holds every overlay in the batch (one page per row), so
+        # ReportLab's document setup is paid once per batch instead of per row.
+        # Page streams are left uncompressed: they are tiny, and the merge
+        # would only have to inflate them again.
+        overlay_packet = io.BytesIO()
+        c = canvas.Canvas(overlay_packet, pagesize=(w, h), pageCompression=0)
+
+        for idx, student, school in rows:
+            # Draw Student Name
+            c.setFillColorRGB(*student_rgb)
+            c.setFont(student_font, student_font_size)
+            c.drawCentredString(student_x, student_y, student)
+
+            # Draw School Name
+            if school:
+                c.setFillColorRGB(*school_rgb)
+                c.setFont(school_font, school_font_size)
+                c.drawCentredString(school_x, school_y, school)
+
+            c.showPage()
+
+        c.save()
+        overlay_packet.seek(0)
+
+        # Parse the overlay document once for the whole batch
+        if pikepdf is not None:
+            overlay = pikepdf.open(overlay_packet)
+        else:
+            overlay = PdfReader(overlay_packet)
+        overlays = overlay.pages
+
+    except Exception as e:
+        return [(filename, None, str(e)) for filename in filenames]
+
+    # Merge PDF pages and write one output PDF per row
+    results = []
+    for filename, overlay_page in zip(filenames, overlays):
+        try:
+            if pikepdf is not None:
+                pdf_bytes = _merge_pikepdf(template, overlay_page)
+            else:
+                pdf_bytes = _merge_pypdf(template, overlay_page)
+            results.append((filename, pdf_bytes, None))
+        except Exception as e:
+            results.append((filename, None, str(e)))
+
+    return results